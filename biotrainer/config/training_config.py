@@ -50,6 +50,51 @@ def training_config(protocol: Protocol) -> Tuple[ConfigKey, List[ConfigOption]]:
                 type=bool,
             )
         ),
+        ConfigOption(
+            name="gradient_accumulation_steps",
+            description="Define the number of batches over which gradients are accumulated before the model weights "
+                        "are updated. Allows larger effective batch sizes without additional memory.",
+            category=training_category,
+            required=False,
+            default=1,
+            constraints=ConfigConstraints(
+                type=int,
+                gt=0)
+        ),
+        ConfigOption(
+            name="use_gradient_checkpointing",
+            description="Define whether to recompute intermediate activations during the backward pass instead of "
+                        "storing them (if applicable). Reduces memory consumption at the cost of additional compute.",
+            category=training_category,
+            required=False,
+            default=False,
+            constraints=ConfigConstraints(
+                type=bool,
+            )
+        ),
+        ConfigOption(
+            name="use_mixed_precision",
+            description="Define whether to use bfloat16 mixed precision for model training. "
+                        "Only applied on GPUs that support bfloat16.",
+            category=training_category,
+            required=False,
+            default=True,
+            constraints=ConfigConstraints(
+                type=bool,
+            )
+        ),
+        ConfigOption(
+            name="use_optimizer_in_comm_hook",
+            description="Define whether to run the optimizer step inside the gradient communication of distributed "
+                        "training (torchrun). Overlaps the optimizer with the communication, but the optimizer state "
+                        "is not stored in the checkpoints.",
+            category=training_category,
+            required=False,
+            default=False,
+            constraints=ConfigConstraints(
+                type=bool,
+            )
+        ),
         ConfigOption(
             name="use_class_weights",
             description="Define whether to use class weights for training, "
@@ -1,16 +1,17 @@
 from __future__ import annotations
 
+import io
 import os
 import torch
-import onnx
-import tempfile
 import onnxruntime
 import numpy as np
 
 from ruamel import yaml
 from pathlib import Path
-from copy import deepcopy
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from torch.utils.data import DataLoader
+from torch.nn.utils.rnn import pad_sequence
 from typing import Union, Optional, Dict, Iterable, Tuple, Any, List
 
 from ..losses import get_loss
@@ -35,7 +36,10 @@ class Inferencer:
             class_str_to_int: Optional[Dict[str, int]] = None,
             device: Union[None, str, torch.device] = None,
             disable_pytorch_compile: Optional[bool] = None,
+            compile_mode: Optional[str] = None,
             allow_torch_pt_loading: bool = True,
+            num_workers: int = 0,
+            prefetch_factor: int = 4,
             # Everything else
             **kwargs
     ):
@@ -44,9 +48,15 @@ class Inferencer:
         self.embedding_dimension = n_features
         self.class_int2str = class_int_to_string
         self.class_str2int = class_str_to_int
+        self._class_lookup_table = self._create_class_lookup_table(class_str_to_int)
         self.device = get_device(device)
         self.disable_pytorch_compile = True if disable_pytorch_compile is None else disable_pytorch_compile
+        # Like in the trainer, CUDA graphs are used by default on GPUs, other devices keep the aot_eager backend
+        self.compile_mode = compile_mode if compile_mode is not None \
+            else ("reduce-overhead" if self.device.type == "cuda" else None)
         self.allow_torch_pt_loading = allow_torch_pt_loading
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
         self.collate_function = get_collate_function(self.protocol)
 
         self.solvers_and_loaders_by_split = self._create_solvers_and_loaders_by_split(**kwargs)
@@ -74,23 +84,22 @@ class Inferencer:
         """
 
         print(f"Reading {out_file_path}..")
-        with tempfile.TemporaryDirectory() as tmp_dir_name:
-            tmp_output_path = tmp_dir_name + "/tmp_output.yml"
-            with open(out_file_path, "r") as output_file, open(tmp_output_path, "w") as tmp_output_file:
-                ids_list = False
-                for line in output_file.readlines():
-                    if line.strip() == "training_ids:" or line.strip() == "validation_ids:":
-                        ids_list = True
-                        continue
-                    elif ids_list and ("-" in line and ":" not in line):
-                        continue
-                    else:
-                        ids_list = False
-                    if not ids_list:
-                        tmp_output_file.write(line)
-
-            with open(tmp_output_path, "r") as tmp_output_file:
-                output_vars = yaml.load(tmp_output_file, Loader=yaml.RoundTripLoader)
+        filtered_output = io.StringIO()
+        with open(out_file_path, "r") as output_file:
+            ids_list = False
+            for line in output_file:
+                if line.strip() == "training_ids:" or line.strip() == "validation_ids:":
+                    ids_list = True
+                    continue
+                elif ids_list and ("-" in line and ":" not in line):
+                    continue
+                else:
+                    ids_list = False
+                if not ids_list:
+                    filtered_output.write(line)
+
+        filtered_output.seek(0)
+        output_vars = yaml.load(filtered_output, Loader=yaml.RoundTripLoader)
 
         if automatic_path_correction:
             log_dir = output_vars["log_dir"]
@@ -118,59 +127,110 @@ class Inferencer:
         return cls(**output_vars), output_vars
 
     def _create_solvers_and_loaders_by_split(self, **kwargs) -> Dict[str, Tuple[Any, Any]]:
-        result_dict = {}
-        splits = kwargs["split_results"].keys()
         log_dir = kwargs["log_dir"]
-        split_checkpoints = {file.split("_checkpoint.")[0]: file for file in os.listdir(log_dir) if
-                             (Path(log_dir) / Path(file)).is_file()}
-        for split in splits:
-            # Ignore average or best result
-            if "average" in split or "best" in split:
-                continue
-            split_config = deepcopy(kwargs)
-            for key, value in kwargs["split_results"][split]["split_hyper_params"].items():
-                split_config[key] = value
-
-            # Positional arguments
-            model_choice = split_config.pop("model_choice")
-            n_classes = split_config.pop("n_classes")
-            loss_choice = split_config.pop("loss_choice")
-            optimizer_choice = split_config.pop("optimizer_choice")
-            learning_rate = split_config.pop("learning_rate")
-            log_dir = split_config.pop("log_dir")
-            checkpoint_path = Path(log_dir) / Path(split_checkpoints[split])
-
-            model = get_model(protocol=self.protocol, model_choice=model_choice,
-                              n_classes=n_classes, n_features=self.embedding_dimension,
-                              disable_pytorch_compile=self.disable_pytorch_compile,
-                              **split_config
-                              )
-            loss_function = get_loss(protocol=self.protocol, loss_choice=loss_choice,
-                                     device=self.device,
-                                     **split_config
-                                     )
-            optimizer = get_optimizer(protocol=self.protocol, optimizer_choice=optimizer_choice,
-                                      model_parameters=model.parameters(), learning_rate=learning_rate,
-                                      **split_config
-                                      )
-
-            solver = get_solver(protocol=self.protocol, name=split, network=model, optimizer=optimizer,
-                                loss_function=loss_function, device=self.device, log_dir=log_dir,
-                                num_classes=n_classes)
-            solver.load_checkpoint(checkpoint_path=checkpoint_path, resume_training=False,
-                                   allow_torch_pt_loading=self.allow_torch_pt_loading)
-
-            def dataloader_function(dataset):
-                return DataLoader(dataset=dataset, batch_size=split_config["batch_size"],
-                                  shuffle=False, drop_last=False,
-                                  collate_fn=self.collate_function)
-
-            result_dict[split] = (solver, dataloader_function)
-        return result_dict
+        # DirEntry.is_file() uses the file type cached by scandir and does not need a stat call per entry
+        with os.scandir(log_dir) as log_dir_entries:
+            split_checkpoints = {entry.name.split("_checkpoint.")[0]: entry.name for entry in log_dir_entries
+                                 if entry.is_file()}
+        # Ignore average or best result
+        splits = [split for split in kwargs["split_results"].keys() if "average" not in split and "best" not in split]
+
+        # Loading checkpoints is mostly I/O, so the splits can be loaded in parallel threads
+        with ThreadPoolExecutor(max_workers=max(1, min(len(splits), 4))) as executor:
+            solvers_and_loaders = dict(zip(splits, executor.map(
+                lambda split: self._create_solver_and_loader(split, split_checkpoints[split], **kwargs), splits
+            )))
+        # The warm-up must run in the calling thread: CUDA graphs are recorded per thread and can only be
+        # replayed in the thread that recorded them
+        if not self.disable_pytorch_compile:
+            for split, (solver, _) in solvers_and_loaders.items():
+                self._warm_up_compiled_network(solver, batch_size=self._get_split_config(split, **kwargs)["batch_size"])
+        return solvers_and_loaders
+
+    @staticmethod
+    def _get_split_config(split: str, **kwargs) -> Dict[str, Any]:
+        # A shallow merge is sufficient, because the config values are only read, never mutated, downstream
+        return {**kwargs, **kwargs["split_results"][split]["split_hyper_params"]}
+
+    def _create_solver_and_loader(self, split: str, checkpoint_file_name: str, **kwargs) -> Tuple[Any, Any]:
+        split_config = self._get_split_config(split, **kwargs)
+
+        # Positional arguments
+        model_choice = split_config.pop("model_choice")
+        n_classes = split_config.pop("n_classes")
+        loss_choice = split_config.pop("loss_choice")
+        optimizer_choice = split_config.pop("optimizer_choice")
+        learning_rate = split_config.pop("learning_rate")
+        log_dir = split_config.pop("log_dir")
+        checkpoint_path = Path(log_dir) / Path(checkpoint_file_name)
+
+        model = get_model(protocol=self.protocol, model_choice=model_choice,
+                          n_classes=n_classes, n_features=self.embedding_dimension,
+                          disable_pytorch_compile=self.disable_pytorch_compile,
+                          compile_mode=self.compile_mode,
+                          **split_config
+                          )
+        loss_function = get_loss(protocol=self.protocol, loss_choice=loss_choice,
+                                 device=self.device,
+                                 **split_config
+                                 )
+        optimizer = get_optimizer(protocol=self.protocol, optimizer_choice=optimizer_choice,
+                                  model_parameters=model.parameters(), learning_rate=learning_rate,
+                                  **split_config
+                                  )
+
+        solver = get_solver(protocol=self.protocol, name=split, network=model, optimizer=optimizer,
+                            loss_function=loss_function, device=self.device, log_dir=log_dir,
+                            num_classes=n_classes)
+        solver.load_checkpoint(checkpoint_path=checkpoint_path, resume_training=False,
+                               allow_torch_pt_loading=self.allow_torch_pt_loading)
+
+        def dataloader_function(dataset):
+            return DataLoader(dataset=dataset, batch_size=split_config["batch_size"],
+                              shuffle=False, drop_last=False,
+                              collate_fn=self.collate_function,
+                              num_workers=self.num_workers,
+                              # Prefetching is only possible with worker processes
+                              prefetch_factor=self.prefetch_factor if self.num_workers > 0 else None,
+                              # Pinned memory allows asynchronous host to device copies
+                              pin_memory=self.device.type == "cuda")
+
+        return solver, dataloader_function
+
+    def _warm_up_compiled_network(self, solver, batch_size: int):
+        """
+        Pays the compilation cost of a compiled network once with dummy inputs of the batch shape of the dataloader,
+        instead of on the first user-facing prediction call.
+        The shape is kept static, so that CUDA graphs (compile_mode "reduce-overhead") can be used for it. The
+        first call compiles the network, the second one records the CUDA graph, which later batches replay.
+        """
+        solver.network.eval()
+        dummy_input = self.protocol.get_dummy_input(self.embedding_dimension, batch_size=batch_size).to(self.device)
+        with torch.inference_mode():
+            for _ in range(2):
+                solver.network(dummy_input)
+
+    @staticmethod
+    def _create_class_lookup_table(class_str2int: Optional[Dict[str, int]]) -> Optional[np.ndarray]:
+        """
+        Creates a lookup table from ascii code to class int, if all classes are single ascii characters.
+        Allows to convert per-residue class strings with one vectorized numpy gather.
+        """
+        if not class_str2int or not all(len(class_str) == 1 and class_str.isascii() for class_str in class_str2int):
+            return None
+        lookup_table = np.full(128, -1, dtype=np.int64)
+        for class_str, class_int in class_str2int.items():
+            lookup_table[ord(class_str)] = class_int
+        return lookup_table
 
     def _convert_class_str2int(self, to_convert: str):
         if type(to_convert) is str:
             if self.protocol in Protocol.per_residue_protocols():
+                if self._class_lookup_table is not None and to_convert.isascii():
+                    converted = self._class_lookup_table[np.frombuffer(to_convert.encode("ascii"), dtype=np.uint8)]
+                    if (converted >= 0).all():
+                        return converted
+                # Fallback for non-ascii strings or unknown classes, the latter raise a KeyError here
                 return [self.class_str2int[t] for t in to_convert]
             else:
                 return self.class_str2int[to_convert]
@@ -179,32 +239,48 @@ class Inferencer:
 
     @staticmethod
     def _pad_tensor(protocol: Protocol, target: Union[Any, torch.Tensor], length_to_pad: int, device):
-        target_tensor = torch.as_tensor(target, device=device)
+        # Pad where the target already lives (usually the CPU) and move the result with a single copy
+        target_tensor = torch.as_tensor(target)
         if protocol in Protocol.per_residue_protocols():
             if target_tensor.shape[0] < length_to_pad:
                 padding_size = length_to_pad - target_tensor.shape[0]
                 padding = torch.full((padding_size,), MASK_AND_LABELS_PAD_VALUE, dtype=target_tensor.dtype,
-                                     device=device)
-                return torch.cat([target_tensor, padding])
-            else:
-                return target_tensor
+                                     device=target_tensor.device)
+                target_tensor = torch.cat([target_tensor, padding])
+        return target_tensor.to(device, non_blocking=True)
+
+    def _convert_targets(self, targets: List) -> torch.Tensor:
+        """
+        Converts all targets (or predictions) into one tensor on the device, padded for per-residue protocols.
+        The tensor is built on the CPU, so that only one host to device copy is necessary.
+        """
+        if self.protocol in Protocol.classification_protocols():
+            targets = [self._convert_class_str2int(target) for target in targets]
+
+        if self.protocol in Protocol.per_residue_protocols():
+            targets_tensor = pad_sequence([torch.as_tensor(target) for target in targets],
+                                          batch_first=True, padding_value=MASK_AND_LABELS_PAD_VALUE)
         else:
-            return target_tensor
+            targets_tensor = torch.as_tensor(targets)
+
+        if self.device.type == "cuda":
+            targets_tensor = targets_tensor.pin_memory()
+        return targets_tensor.to(self.device, non_blocking=True)
 
     def _convert_target_dict(self, target_dict: Dict[str, str]):
-        if self.protocol in Protocol.classification_protocols():
-            if self.protocol in Protocol.per_residue_protocols():
-                max_prediction_length = len(max(target_dict.values(), key=len))
-                return {seq_id: self._pad_tensor(protocol=self.protocol, target=self._convert_class_str2int(prediction),
-                                                 length_to_pad=max_prediction_length, device=self.device)
-                        for seq_id, prediction in target_dict.items()}
-            else:
-                return {seq_id: torch.tensor(self._convert_class_str2int(prediction),
-                                             device=self.device)
-                        for seq_id, prediction in target_dict.items()}
-        return {seq_id: torch.tensor(prediction,
-                                     device=self.device)
-                for seq_id, prediction in target_dict.items()}
+        return dict(zip(target_dict.keys(), self._convert_targets(list(target_dict.values()))))
+
+    @staticmethod
+    def _as_tensor(embedding: Union[torch.Tensor, np.ndarray, Iterable]) -> torch.Tensor:
+        """
+        Converts an embedding to a tensor without copying it, if it already is a tensor or a numpy array.
+        """
+        if isinstance(embedding, torch.Tensor):
+            return embedding
+        if isinstance(embedding, np.ndarray):
+            # Shares memory with the numpy array
+            return torch.from_numpy(embedding)
+        return torch.from_numpy(np.asarray(embedding, dtype=np.float32))
 
     def _load_solver_and_dataloader(self, embeddings: Union[Iterable, Dict],
                                     split_name, targets: Optional[List] = None):
@@ -221,8 +297,8 @@ class Inferencer:
 
         solver, loader = self.solvers_and_loaders_by_split[split_name]
         dataset = get_dataset(self.protocol, samples=[
-            DatasetSample(seq_id, torch.tensor(np.array(embedding)),
-                          torch.empty(1) if not targets else torch.tensor(np.array(targets[idx])))
+            DatasetSample(seq_id, self._as_tensor(embedding),
+                          torch.empty(1) if not targets else torch.as_tensor(targets[idx]))
             for idx, (seq_id, embedding) in enumerate(embeddings_dict.items())
         ])
         dataloader = loader(dataset)
@@ -251,6 +327,7 @@ class Inferencer:
             result_file_paths.append(onnx_save_path)
         return result_file_paths
 
+    @torch.inference_mode()
     def from_embeddings(self, embeddings: Union[Iterable, Dict], targets: Optional[List] = None,
                         split_name: str = "hold_out",
                         include_probabilities: bool = False) -> Dict[str, Union[Dict, str, int, float]]:
@@ -286,6 +363,7 @@ class Inferencer:
         else:
             return inference_dict
 
+    @torch.inference_mode()
     def from_embeddings_with_bootstrapping(self, embeddings: Union[Iterable, Dict], targets: List,
                                            split_name: str = "hold_out",
                                            iterations: int = 30,
@@ -324,11 +402,10 @@ class Inferencer:
 
         seq_ids = list(embeddings_dict.keys())
 
-        all_predictions = self.from_embeddings(embeddings_dict, targets)["mapped_predictions"]
+        # Metrics are calculated from the bootstrapping samples, so only the predictions are needed here
+        all_predictions = self.from_embeddings(embeddings_dict, split_name=split_name)["mapped_predictions"]
         all_predictions_dict = self._convert_target_dict(all_predictions)
-
-        all_targets_dict = {seq_id: targets[idx] for idx, seq_id in enumerate(seq_ids)}
-        all_targets_dict = self._convert_target_dict(all_targets_dict)
+        all_targets_dict = dict(zip(seq_ids, self._convert_targets(targets)))
 
         solver, _ = self.solvers_and_loaders_by_split[split_name]
 
@@ -369,26 +446,34 @@ class Inferencer:
             seed = 42  # Default value
         rng = np.random.RandomState(seed)
 
+        # Stack predictions and targets once and draw all bootstrapping samples upfront as indices into them
+        all_predictions = torch.stack([all_predictions_dict[seq_id] for seq_id in seq_ids])
+        all_targets = torch.stack([all_targets_dict[seq_id] for seq_id in seq_ids])
+        bootstrapping_samples = torch.from_numpy(
+            rng.randint(0, len(seq_ids), size=(iterations, sample_size))
+        ).to(all_predictions.device)
+
         for iteration in range(iterations):
-            bootstrapping_sample = rng.choice(seq_ids, size=sample_size, replace=True)
-            sampled_predictions = torch.stack([all_predictions_dict[seq_id] for seq_id in bootstrapping_sample])
-            sampled_targets = torch.stack([all_targets_dict[seq_id] for seq_id in bootstrapping_sample])
+            bootstrapping_sample = bootstrapping_samples[iteration]
+            sampled_predictions = all_predictions.index_select(0, bootstrapping_sample)
+            sampled_targets = all_targets.index_select(0, bootstrapping_sample.to(all_targets.device))
             iteration_result = metrics_calculator.compute_metrics(predicted=sampled_predictions,
                                                        labels=sampled_targets)
             iteration_results.append(iteration_result)
 
         # Calculate mean and error margin for each metric
         metrics = list(iteration_results[0].keys())
-        result_dict = {}
-        for metric in metrics:
-            all_metric_values = [iteration_result[metric] for iteration_result in iteration_results]
-            mean, confidence_range = get_mean_and_confidence_range(
-                values=torch.tensor(all_metric_values, dtype=torch.float16),
-                dimension=0,
-                confidence_level=confidence_level)
-            result_dict[metric] = {"mean": mean.item(), "error": confidence_range.item()}
+        # (Metrics x Iterations)
+        metric_values = torch.from_numpy(np.asarray([[iteration_result[metric] for iteration_result in iteration_results]
+                                                     for metric in metrics], dtype=np.float32))
+        means, confidence_ranges = get_mean_and_confidence_range(values=metric_values,
+                                                                 dimension=1,
+                                                                 confidence_level=confidence_level)
+        result_dict = {metric: {"mean": mean, "error": confidence_range}
+                       for metric, mean, confidence_range in zip(metrics, means.tolist(), confidence_ranges.tolist())}
         return result_dict
 
+    @torch.inference_mode()
     def from_embeddings_with_monte_carlo_dropout(self, embeddings: Union[Iterable, Dict],
                                                  split_name: str = "hold_out",
                                                  n_forward_passes: int = 30,
@@ -428,24 +513,36 @@ class Inferencer:
 
         # For class predictions, revert from int (model output) to str (class name)
         if self.protocol in Protocol.per_residue_protocols():
-            for seq_id, prediction_list in predictions.items():
-                for prediction_dict in prediction_list:
-                    prediction_dict["prediction"] = list(revert_mappings(protocol=self.protocol,
-                                                                         test_predictions={
-                                                                             seq_id: prediction_dict["prediction"]
-                                                                         },
-                                                                         class_int2str=self.class_int2str).values())[0]
+            prediction_dicts = [prediction_dict for prediction_list in predictions.values()
+                                for prediction_dict in prediction_list]
         else:
-            for seq_id, prediction_dict in predictions.items():
-                prediction_dict["prediction"] = list(revert_mappings(protocol=self.protocol,
-                                                                     test_predictions={
-                                                                         seq_id: prediction_dict["prediction"]
-                                                                     },
-                                                                     class_int2str=self.class_int2str).values())[0]
+            prediction_dicts = list(predictions.values())
+        # Revert all predictions with one call, keyed by their position in prediction_dicts
+        reverted_predictions = revert_mappings(protocol=self.protocol,
+                                               test_predictions={idx: prediction_dict["prediction"]
+                                                                 for idx, prediction_dict in
+                                                                 enumerate(prediction_dicts)},
+                                               class_int2str=self.class_int2str)
+        for idx, prediction_dict in enumerate(prediction_dicts):
+            prediction_dict["prediction"] = reverted_predictions[idx]
 
         return predictions
 
     @staticmethod
+    @lru_cache(maxsize=4)
+    def _get_ort_session(model_path: str, modification_time: float) -> onnxruntime.InferenceSession:
+        """
+        Creating and optimizing an onnxruntime session is expensive, so sessions are cached for repeated calls.
+        The modification time of the model file is part of the cache key to avoid using outdated sessions.
+        """
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        ep_list = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+        return onnxruntime.InferenceSession(model_path, sess_options=session_options, providers=ep_list)
+
+    @staticmethod
+    @torch.inference_mode()
     def from_onnx_with_embeddings(model_path: str, embeddings: Union[Iterable, Dict],
                                   protocol: Optional[Protocol] = None):
         if isinstance(embeddings, Dict):
@@ -453,18 +550,37 @@ class Inferencer:
         else:
             embeddings_dict = {str(idx): embedding for idx, embedding in enumerate(embeddings)}
 
-        onnx_model = onnx.load(model_path)
-        onnx.checker.check_model(onnx_model)
+        ort_session = Inferencer._get_ort_session(model_path=str(model_path),
+                                                 modification_time=os.path.getmtime(model_path))
 
-        ep_list = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-        ort_session = onnxruntime.InferenceSession(model_path, providers=ep_list)
+        # Query the model signature only once
+        model_input = ort_session.get_inputs()[0]
+        output_names = [ort_session.get_outputs()[0].name]
+        input_feed = {model_input.name: None}
 
-        result_dict = {}
+        # Models exported with a static batch dimension can only predict a fixed number of embeddings at once
+        input_batch_dimension = model_input.shape[0]
+        batch_size = input_batch_dimension if isinstance(input_batch_dimension, int) else len(embeddings_dict)
+
+        # Group embeddings by shape, so that all embeddings with the same shape (all per-sequence embeddings or
+        # per-residue embeddings of the same length) can be predicted in one batch without padding
+        seq_ids_by_shape = {}
         for seq_id, embedding in embeddings_dict.items():
-            input_feed = {ort_session.get_inputs()[0].name: np.expand_dims(embedding, axis=0)}
-            ort_outs = ort_session.run(None, input_feed=input_feed)
+            seq_ids_by_shape.setdefault(np.shape(embedding), []).append(seq_id)
+        seq_id_batches = [seq_ids[idx:idx + batch_size] for seq_ids in seq_ids_by_shape.values()
+                          for idx in range(0, len(seq_ids), batch_size)]
+
+        results_by_seq_id = {}
+        for seq_ids in seq_id_batches:
+            input_feed[model_input.name] = np.stack([np.asarray(embeddings_dict[seq_id], dtype=np.float32)
+                                                     for seq_id in seq_ids], axis=0)
+            ort_outs = ort_session.run(output_names, input_feed=input_feed)[0]
             if protocol is not None and protocol in Protocol.classification_protocols():
-                result_dict[seq_id] = torch.softmax(torch.tensor(ort_outs[0][0]), dim=0).tolist()
+                batch_probabilities = torch.softmax(torch.from_numpy(ort_outs), dim=1).tolist()
+                for seq_id, probabilities in zip(seq_ids, batch_probabilities):
+                    results_by_seq_id[seq_id] = probabilities
             else:
-                result_dict[seq_id] = ort_outs[0][0].tolist()[0]
-        return result_dict
+                for seq_id, ort_out in zip(seq_ids, ort_outs):
+                    results_by_seq_id[seq_id] = ort_out.tolist()[0]
+        # The batches are grouped by shape, the results are returned in the order of the given embeddings
+        return {seq_id: results_by_seq_id[seq_id] for seq_id in embeddings_dict}
@@ -42,6 +42,7 @@ __MODELS = {
 
 def get_model(protocol: Protocol, model_choice: str, n_classes: int, n_features: int,
               disable_pytorch_compile: Optional[bool] = True,
+              compile_mode: Optional[str] = None,
               **kwargs):
     model_class = __MODELS.get(protocol).get(model_choice)
     if not model_class:
@@ -49,6 +50,9 @@ def get_model(protocol: Protocol, model_choice: str, n_classes: int, n_features:
     else:
         if "dropout_rate" in kwargs.keys() and "dropout_rate" not in inspect.signature(model_class).parameters:
             logger.warning(f"dropout_rate not implemented for model_choice {model_choice}")
+        if (kwargs.get("use_gradient_checkpointing", False) and
+                "use_gradient_checkpointing" not in inspect.signature(model_class).parameters):
+            logger.warning(f"use_gradient_checkpointing not implemented for model_choice {model_choice}")
 
         model = model_class(n_classes=n_classes, n_features=n_features, **kwargs)
         # Disable option for backwards compatibility with older models or if there emerge problems during training
@@ -56,6 +60,14 @@ def get_model(protocol: Protocol, model_choice: str, n_classes: int, n_features:
             logger.info(f"Using pytorch model compile mode!")
             # Using TensorFloat32 tensor cores is suggested when using a compiled model:
             torch.set_float32_matmul_precision('high')
+            if compile_mode == "reduce-overhead":
+                # CUDA graphs are only captured for static shapes. Without dynamic=False, the first batch of another
+                # shape (e.g. the last one) recompiles the model with a dynamic batch dimension, which would then run
+                # all batches without CUDA graphs. Instead, every shape gets its own graph, up to the recompile limit
+                return torch.compile(model, mode=compile_mode, dynamic=False, fullgraph=False)
+            if compile_mode is not None:
+                # Explicit compile modes require the default inductor backend
+                return torch.compile(model, mode=compile_mode, fullgraph=False)
             return torch.compile(model, backend="aot_eager")
         return model
 
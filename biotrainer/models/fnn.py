@@ -1,14 +1,19 @@
+import torch
 import torch.nn as nn
 
+from torch.utils.checkpoint import checkpoint_sequential
+
 
 # Feed-Forward Neural Network (FNN) with two linear layers connected by a non-lin
 class FNN(nn.Module):
     def __init__(
             self, n_classes: int, n_features: int,
             bottleneck_dim: int = 32, dropout_rate: float = 0.25,
+            use_gradient_checkpointing: bool = False,
             **kwargs
     ):
         super(FNN, self).__init__()
+        self.use_gradient_checkpointing = use_gradient_checkpointing
 
         self.classifier = nn.Sequential(
             nn.Linear(n_features, bottleneck_dim),  # n_features x 32
@@ -25,6 +30,10 @@ class FNN(nn.Module):
             N = number of classes (9 for conservation)
         """
         # IN: X = (B x L x F)
+        if self.use_gradient_checkpointing and self.training and torch.is_grad_enabled():
+            # The activations of the first half of the classifier are recomputed during the backward pass.
+            # The last segment is never recomputed, so more segments only add boundaries that are stored anyway
+            return checkpoint_sequential(self.classifier, segments=2, input=x, use_reentrant=False)
         Yhat = self.classifier(x)  # OUT: Yhat_consurf = (B x L x N)
         return Yhat
 
@@ -33,9 +42,11 @@ class DeeperFNN(FNN):
     def __init__(
             self, n_classes: int, n_features: int,
             bottleneck_dim: int = 128, dropout_rate: float = 0.25,
+            use_gradient_checkpointing: bool = False,
             **kwargs
     ):
         super(FNN, self).__init__()
+        self.use_gradient_checkpointing = use_gradient_checkpointing
 
         self.classifier = nn.Sequential(
             nn.Linear(n_features, bottleneck_dim),  # n_features x 128 (for default)
@@ -50,11 +50,9 @@ class Protocol(Enum):
     def from_string(string: str) -> Protocol:
         return {p.name: p for p in Protocol.all()}[string]
 
-    def get_dummy_input(self, embedding_dimension: int):
-        batch_size = 1
-        default_sequence_length = 50
+    def get_dummy_input(self, embedding_dimension: int, batch_size: int = 1, sequence_length: int = 50):
         if self in Protocol.using_per_residue_embeddings():
-            return torch.rand((batch_size, default_sequence_length, embedding_dimension), dtype=torch.float32)
+            return torch.rand((batch_size, sequence_length, embedding_dimension), dtype=torch.float32)
         return torch.rand((batch_size, embedding_dimension), dtype=torch.float32)
 
     def __str__(self):
@@ -35,10 +35,14 @@ __METRICS_CALCULATORS = {
 def get_solver(protocol: Protocol, name: str,
                network: Optional = None, optimizer: Optional = None, loss_function: Optional = None,
                device: Optional = None, number_of_epochs: Optional = None,
-               patience: Optional = None, epsilon: Optional = None, log_writer: Optional = None,
+               patience: Optional = None, epsilon: Optional = None, gradient_accumulation_steps: int = 1,
+               use_mixed_precision: bool = True, use_optimizer_in_comm_hook: bool = False,
+               log_writer: Optional = None,
                log_dir: Optional = None, num_classes: Optional[int] = 0,
+               local_rank: Optional[int] = None,
                **kwargs
                ) -> Solver:
+    # Batches are copied to the device with non_blocking=True, so dataloaders should use pin_memory=True on GPUs
     solver = __SOLVERS.get(protocol)
     metrics_calc = get_metrics_calculator(protocol=protocol, device=device, num_classes=num_classes)
 
@@ -49,8 +53,10 @@ def get_solver(protocol: Protocol, name: str,
             name=name, protocol=protocol,
             network=network, optimizer=optimizer, loss_function=loss_function, metrics_calculator=metrics_calc,
             device=device, number_of_epochs=number_of_epochs,
-            patience=patience, epsilon=epsilon, log_writer=log_writer,
-            log_dir=log_dir, num_classes=num_classes
+            patience=patience, epsilon=epsilon, gradient_accumulation_steps=gradient_accumulation_steps,
+            use_mixed_precision=use_mixed_precision, use_optimizer_in_comm_hook=use_optimizer_in_comm_hook,
+            log_writer=log_writer,
+            log_dir=log_dir, num_classes=num_classes, local_rank=local_rank
         )
 
 
@@ -3,7 +3,7 @@ from __future__ import annotations
 import torch
 
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Union
+from typing import Optional, Dict, Union, List
 from torchmetrics import Accuracy, Precision, Recall, F1Score, SpearmanCorrCoef, MatthewsCorrCoef, Metric, \
     MeanSquaredError
 
@@ -15,20 +15,61 @@ class MetricsCalculator(ABC):
         self.device = device
         self.num_classes = num_classes
 
+    def _get_metrics(self) -> List[Metric]:
+        # All metric attributes that are instances of torchmetrics.Metric
+        return [attr for attr in vars(self).values() if isinstance(attr, Metric)]
+
+    def _metrics_to_device(self):
+        # Keep the metric states on the device of the predictions to avoid copies and synchronization per batch
+        if self.device is not None:
+            for metric in self._get_metrics():
+                metric.to(self.device)
+
+    def to(self, device) -> MetricsCalculator:
+        """ Move the metric states to the given device, e.g. to the device of the process in distributed training """
+        self.device = device
+        self._metrics_to_device()
+        return self
+
     def reset(self) -> MetricsCalculator:
-        # Reset all metric attributes that are instances of torchmetrics.Metric
-        for attr_name in dir(self):
-            attr = getattr(self, attr_name)
-            if isinstance(attr, Metric):
-                attr.reset()
+        for metric in self._get_metrics():
+            metric.reset()
         return self
 
-    @abstractmethod
+    def update(self, predicted: torch.Tensor, labels: torch.Tensor):
+        """
+        Accumulate the metric states for a batch without computing the metrics for the batch itself.
+        Other than compute_metrics, this does not require a synchronization between device and host.
+
+        :param predicted: The predicted label/value for each sample
+        :param labels: The actual label for each sample
+        """
+        for metric in self._get_metrics():
+            predicted_on_device, labels_on_device = self._to_metric_input(metric, predicted, labels)
+            metric.update(predicted_on_device, labels_on_device)
+
     def compute_metrics(
             self, predicted: Optional[torch.Tensor] = None,
             labels: Optional[torch.Tensor] = None) -> Dict[str, Union[int, float]]:
+        return {name: value.item() for name, value in self.compute_metric_tensors(predicted, labels).items()}
+
+    @abstractmethod
+    def compute_metric_tensors(
+            self, predicted: Optional[torch.Tensor] = None,
+            labels: Optional[torch.Tensor] = None) -> Dict[str, torch.Tensor]:
+        """
+        Same as compute_metrics, but the metrics are returned as 0-d tensors on the device of the metrics,
+        so no synchronization between device and host is required for batches.
+        """
         raise NotImplementedError
 
+    @staticmethod
+    def _to_metric_input(metric: Metric, predicted: torch.Tensor, labels: torch.Tensor) -> (torch.Tensor, torch.Tensor):
+        if metric.__class__ == SpearmanCorrCoef:
+            # SCC only accepts float tensors
+            return predicted.to(metric.device).float(), labels.to(metric.device).float()
+        return predicted.to(metric.device), labels.to(metric.device)
+
     @staticmethod
     def _compute_metric(metric: Metric, predicted: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
         """
@@ -47,10 +88,7 @@ class MetricsCalculator(ABC):
             return metric_result
         else:
             # Per batch
-            if metric.__class__ == SpearmanCorrCoef:
-                # SCC only accepts float tensors
-                return metric(predicted.cpu().float(), labels.cpu().float())
-            return metric(predicted.cpu(), labels.cpu())
+            return metric(*MetricsCalculator._to_metric_input(metric, predicted, labels))
 
 
 class ClassificationMetricsCalculator(MetricsCalculator):
@@ -76,43 +114,45 @@ class ClassificationMetricsCalculator(MetricsCalculator):
         self.scc = SpearmanCorrCoef()
         self.mcc = MatthewsCorrCoef(task=task, num_classes=self.num_classes)
 
-    def compute_metrics(
+        self._metrics_to_device()
+
+    def compute_metric_tensors(
             self, predicted: Optional[torch.Tensor] = None,
-            labels: Optional[torch.Tensor] = None) -> Dict[str, Union[int, float]]:
+            labels: Optional[torch.Tensor] = None) -> Dict[str, torch.Tensor]:
         def _compute_metric(metric) -> torch.Tensor:
             # To shorten the code below, this delegate function is used
             return self._compute_metric(metric, predicted=predicted, labels=labels)
 
-        metrics_dict = {'accuracy': _compute_metric(self.acc).item()}
+        metrics_dict = {'accuracy': _compute_metric(self.acc)}
 
         # Multi-class prediction
         if self.num_classes > 2:
             precision_per_class = _compute_metric(self.precision_per_class)
-            precisions = {'- precision class {}'.format(i): precision_per_class[i].item() for i in
+            precisions = {'- precision class {}'.format(i): precision_per_class[i] for i in
                           range(self.num_classes)}
-            metrics_dict['macro-precision'] = _compute_metric(self.macro_precision).item()
-            metrics_dict['micro-precision'] = _compute_metric(self.micro_precision).item()
+            metrics_dict['macro-precision'] = _compute_metric(self.macro_precision)
+            metrics_dict['micro-precision'] = _compute_metric(self.micro_precision)
             metrics_dict.update(precisions)
 
             recall_per_class = _compute_metric(self.recall_per_class)
-            recalls = {'- recall class {}'.format(i): recall_per_class[i].item() for i in range(self.num_classes)}
-            metrics_dict['macro-recall'] = _compute_metric(self.macro_recall).item()
-            metrics_dict['micro-recall'] = _compute_metric(self.micro_recall).item()
+            recalls = {'- recall class {}'.format(i): recall_per_class[i] for i in range(self.num_classes)}
+            metrics_dict['macro-recall'] = _compute_metric(self.macro_recall)
+            metrics_dict['micro-recall'] = _compute_metric(self.micro_recall)
             metrics_dict.update(recalls)
 
             f1_per_class = _compute_metric(self.f1_per_class)
-            f1scores = {'- f1_score class {}'.format(i): f1_per_class[i].item() for i in range(self.num_classes)}
-            metrics_dict['macro-f1_score'] = _compute_metric(self.macro_f1_score).item()
-            metrics_dict['micro-f1_score'] = _compute_metric(self.micro_f1_score).item()
+            f1scores = {'- f1_score class {}'.format(i): f1_per_class[i] for i in range(self.num_classes)}
+            metrics_dict['macro-f1_score'] = _compute_metric(self.macro_f1_score)
+            metrics_dict['micro-f1_score'] = _compute_metric(self.micro_f1_score)
             metrics_dict.update(f1scores)
         # Binary prediction
         else:
-            metrics_dict['precision'] = _compute_metric(self.macro_precision).item()
-            metrics_dict['recall'] = _compute_metric(self.macro_recall).item()
-            metrics_dict['f1_score'] = _compute_metric(self.macro_f1_score).item()
+            metrics_dict['precision'] = _compute_metric(self.macro_precision)
+            metrics_dict['recall'] = _compute_metric(self.macro_recall)
+            metrics_dict['f1_score'] = _compute_metric(self.macro_f1_score)
 
-        metrics_dict['spearmans-corr-coeff'] = _compute_metric(self.scc).item()
-        metrics_dict['matthews-corr-coeff'] = _compute_metric(self.mcc).item()
+        metrics_dict['spearmans-corr-coeff'] = _compute_metric(self.scc)
+        metrics_dict['matthews-corr-coeff'] = _compute_metric(self.mcc)
 
         return metrics_dict
 
@@ -125,13 +165,15 @@ class RegressionMetricsCalculator(MetricsCalculator):
         self.rmse = MeanSquaredError(squared=False)
         self.scc = SpearmanCorrCoef()
 
-    def compute_metrics(
+        self._metrics_to_device()
+
+    def compute_metric_tensors(
             self, predicted: Optional[torch.Tensor] = None,
-            labels: Optional[torch.Tensor] = None) -> Dict[str, Union[int, float]]:
+            labels: Optional[torch.Tensor] = None) -> Dict[str, torch.Tensor]:
         return {
-            'mse': self._compute_metric(self.mse, predicted, labels).item(),
-            'rmse': self._compute_metric(self.rmse, predicted, labels).item(),
-            'spearmans-corr-coeff': self._compute_metric(self.scc, predicted, labels).item()
+            'mse': self._compute_metric(self.mse, predicted, labels),
+            'rmse': self._compute_metric(self.rmse, predicted, labels),
+            'spearmans-corr-coeff': self._compute_metric(self.scc, predicted, labels)
         }
 
 
@@ -140,20 +182,26 @@ class SequenceClassificationMetricsCalculator(ClassificationMetricsCalculator):
 
 
 class ResidueClassificationMetricsCalculator(ClassificationMetricsCalculator):
-    def compute_metrics(
+    @staticmethod
+    def _mask(predicted: torch.Tensor, labels: torch.Tensor) -> (torch.Tensor, torch.Tensor):
+        # This will flatten everything!
+        labels = labels.to(predicted.device)
+        masks = labels != MASK_AND_LABELS_PAD_VALUE
+        # Predictions and labels are masked together, so the data-dependent output size is only resolved once
+        masked_predicted, masked_labels = torch.stack([predicted.to(labels.dtype), labels])[:, masks]
+        return masked_predicted, masked_labels
+
+    def update(self, predicted: torch.Tensor, labels: torch.Tensor):
+        super().update(*self._mask(predicted, labels))
+
+    def compute_metric_tensors(
             self, predicted: Optional[torch.Tensor] = None,
-            labels: Optional[torch.Tensor] = None) -> Dict[str, Union[int, float]]:
+            labels: Optional[torch.Tensor] = None) -> Dict[str, torch.Tensor]:
         if predicted is not None and labels is not None:
-            # This will flatten everything!
-            masks = labels != MASK_AND_LABELS_PAD_VALUE
-            masks = masks.to(self.device)
-
-            masked_predicted = torch.masked_select(predicted, masks)
-            masked_labels = torch.masked_select(labels, masks)
-
-            return super().compute_metrics(predicted=masked_predicted, labels=masked_labels)
+            masked_predicted, masked_labels = self._mask(predicted, labels)
+            return super().compute_metric_tensors(predicted=masked_predicted, labels=masked_labels)
         else:
-            return super().compute_metrics(predicted=predicted, labels=labels)
+            return super().compute_metric_tensors(predicted=predicted, labels=labels)
 
 class ResiduesClassificationMetricsCalculator(ClassificationMetricsCalculator):
     pass
@@ -1,17 +1,22 @@
 import torch
 
 from torch.utils.data import DataLoader
-from contextlib import nullcontext as _nullcontext
-from typing import Dict, Union, Optional, Callable, List
+from typing import Dict, Optional, Any
 
 from .solver import Solver
 from .solver_utils import get_mean_and_confidence_range
 
 
 class ResidueClassificationSolver(Solver):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Determined once, because the network type cannot be looked up inside a compiled function
+        network_module = self._get_network_module()
+        network_type = type(getattr(network_module, "_orig_mod", network_module)).__name__
+        self._permute_network_output = network_type in ["FNN", "DeeperFNN", "LogReg"]
+
     def _transform_network_output(self, network_output: torch.Tensor) -> torch.Tensor:
-        network_type = type(self.network).__name__
-        if network_type in ["FNN", "DeeperFNN", "LogReg"]:
+        if self._permute_network_output:
             # (Batch_size x protein_Length x Number_classes) => (B x N x L)
             network_output = network_output.permute(0, 2, 1)
 
@@ -21,9 +26,7 @@ class ResidueClassificationSolver(Solver):
         return torch.softmax(logits, dim=1)
 
     def _probabilities_to_predictions(self, probabilities: torch.Tensor) -> torch.Tensor:
-        _, predicted_classes = torch.max(probabilities, dim=1)
-
-        return predicted_classes
+        return probabilities.argmax(dim=1)
 
     def inference_monte_carlo_dropout(self, dataloader: DataLoader,
                                       n_forward_passes: int = 30,
@@ -79,45 +82,24 @@ class ResidueClassificationSolver(Solver):
             }
 
     # Gets overwritten to shorten prediction lengths if necessary
-    def _training_iteration(
-            self, x: torch.Tensor, y: torch.Tensor, step=1, context: Optional[Callable] = None,
-            lengths: Optional[torch.LongTensor] = None
-    ) -> Dict[str, Union[float, list, Dict[str, Union[float, int]]]]:
-        result_dict = super()._training_iteration(x, y, step, context, lengths)
-        if not context:
-            context = _nullcontext
-
-        with context():
-            prediction = result_dict['prediction']
-            # If lengths is defined, we need to shorten the residue predictions to the length
-            if lengths is not None:
-                return_pred = list()
-                for pred_x, length_x in zip(prediction, lengths):
-                    return_pred.append(pred_x[:length_x])
-
-                result_dict['prediction'] = return_pred
-
-            return result_dict
-
-    # Gets overwritten to shorten prediction lengths if necessary
-    def _prediction_iteration(self, x: torch.Tensor, lengths: Optional[torch.LongTensor] = None) -> Dict[str, List]:
-        result_dict = super()._prediction_iteration(x, lengths)
-        with torch.no_grad():
-            predictions = result_dict['prediction']
-            probabilities = result_dict['probabilities']
-            # If lengths is defined, we need to shorten the residue predictions and probabilities to the length
-            if lengths is not None:
-                shortened_predictions = []
-                shortened_probabilities = []
-                for original_prediction, original_probability, length_to_shorten in zip(predictions, probabilities,
-                                                                                        lengths):
-                    shortened_predictions.append(original_prediction[:length_to_shorten])
-                    shortened_per_class_probabilities = []
-                    for per_class_probabilities in original_probability:
-                        shortened_per_class_probabilities.append(per_class_probabilities[:length_to_shorten])
-                    shortened_probabilities.append(shortened_per_class_probabilities)
-
-                result_dict['prediction'] = shortened_predictions
-                result_dict['probabilities'] = shortened_probabilities
-
-            return result_dict
+    def _iteration_result_to_lists(self, iteration_result: Dict[str, Any],
+                                   lengths: Optional[torch.LongTensor] = None) -> Dict[str, Any]:
+        result_dict = super()._iteration_result_to_lists(iteration_result, lengths)
+        predictions = result_dict['prediction']
+        probabilities = result_dict['probabilities']
+        # If lengths is defined, we need to shorten the residue predictions and probabilities to the length
+        if lengths is not None:
+            shortened_predictions = []
+            shortened_probabilities = []
+            for original_prediction, original_probability, length_to_shorten in zip(predictions, probabilities,
+                                                                                    lengths):
+                shortened_predictions.append(original_prediction[:length_to_shorten])
+                shortened_per_class_probabilities = []
+                for per_class_probabilities in original_probability:
+                    shortened_per_class_probabilities.append(per_class_probabilities[:length_to_shorten])
+                shortened_probabilities.append(shortened_per_class_probabilities)
+
+            result_dict['prediction'] = shortened_predictions
+            result_dict['probabilities'] = shortened_probabilities
+
+        return result_dict
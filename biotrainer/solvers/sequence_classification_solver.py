@@ -9,6 +9,4 @@ class SequenceClassificationSolver(Solver):
         return torch.softmax(logits, dim=1)
 
     def _probabilities_to_predictions(self, probabilities: torch.Tensor) -> torch.Tensor:
-        _, predicted_classes = torch.max(probabilities, dim=1)
-
-        return predicted_classes
+        return probabilities.argmax(dim=1)
@@ -1,16 +1,22 @@
 import os
 import math
+import onnx
+import inspect
 import torch
-import logging
+import torch.distributed as dist
 
 from abc import ABC
 from sys import platform
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
+from torch.distributed.optim.utils import as_functional_optim, functional_optim_map
+from torch.distributed.algorithms.ddp_comm_hooks.default_hooks import allreduce_hook
+from torch.distributed.algorithms.ddp_comm_hooks.optimizer_overlap_hooks import _OptimizerHookState, \
+    _hook_then_optimizer
 from contextlib import nullcontext as _nullcontext
 from safetensors.torch import load_file, save_file
-from typing import Callable, Optional, Union, Dict, List, Any
+from typing import Callable, Optional, Union, Dict, List, Any, Sequence, Tuple
 
 from .metrics_calculator import MetricsCalculator
 from .solver_utils import get_mean_and_confidence_range
@@ -21,6 +27,9 @@ logger = get_logger(__name__)
 
 
 class Solver(ABC):
+    # Number of logits that are collected on the device during inference before they are copied to the cpu.
+    # Bounds the additional device memory for the copy, which first concatenates the batches
+    _TRANSFER_CHUNK_SIZE = 2 ** 24
 
     def __init__(self,
                  # Necessary
@@ -28,9 +37,13 @@ class Solver(ABC):
                  # Optional with defaults
                  log_writer: Optional = None, log_dir: str = "",
                  number_of_epochs: int = 1000, patience: int = 20, epsilon: float = 0.001,
+                 gradient_accumulation_steps: int = 1, use_mixed_precision: bool = True,
+                 use_optimizer_in_comm_hook: bool = False,
                  device: Union[None, str, torch.device] = None,
                  # Used by classification subclasses
-                 num_classes: Optional[int] = 0):
+                 num_classes: Optional[int] = 0,
+                 # Distributed training, set by torchrun via the LOCAL_RANK environment variable
+                 local_rank: Optional[int] = None):
 
         self.checkpoint_type = "safetensors"
         self.checkpoint_name = f"{name}_checkpoint.{self.checkpoint_type}"
@@ -45,72 +58,224 @@ class Solver(ABC):
         self.number_of_epochs = number_of_epochs
         self.patience = patience
         self.epsilon = epsilon
+        self.gradient_accumulation_steps = gradient_accumulation_steps
         self.log_dir = log_dir
+        # Step metrics are computed on the device per batch, but only written after the training iterations of an epoch
+        self._step_log_buffer: List[Tuple[int, Dict[str, torch.Tensor]]] = []
 
         # Early stopping internal variables
         self._best_epoch = 0
         self._min_loss = math.inf
         self._stop_count = patience
-        self._tempdir = TemporaryDirectory()
+        # Resolved once, checkpoints are saved to and loaded from it repeatedly during early stopping
+        self._checkpoint_path = Path(self.log_dir) / self.checkpoint_name if self.log_dir else None
+        # Without a log directory, the checkpoint of the best epoch is only kept in memory
+        self._best_state: Optional[Dict[str, Any]] = None
 
         # Device handling
-        self.device = device
+        self._is_distributed = local_rank is not None
+        self.device = self._init_distributed(local_rank, device) if self._is_distributed else device
+        self._is_main_process = not self._is_distributed or dist.get_rank() == 0
+        if self._is_distributed:
+            # The metrics calculator was created with the configured device, not with the device of this process
+            self.metrics_calculator.to(self.device)
+        # bfloat16 needs no loss scaling, but is only used on GPUs that support it
+        self.use_mixed_precision = use_mixed_precision and self._supports_bf16(self.device)
         self.network = network.to(self.device)
+        if self._is_distributed:
+            self.network = DistributedDataParallel(
+                self.network, device_ids=[local_rank] if torch.device(self.device).type == "cuda" else None,
+                # Gradients share memory with the all-reduce buckets and the graph of the models does not change
+                bucket_cap_mb=25, gradient_as_bucket_view=True, static_graph=True
+            )
+        self._compile_output_and_loss()
+        # The optimizer in the communication hook steps after every backward pass, so it cannot accumulate gradients.
+        # Its state only exists in the hook and is not saved in the checkpoints, so it must be enabled explicitly.
+        self._optimizer_in_comm_hook = (use_optimizer_in_comm_hook and self._is_distributed
+                                        and self.gradient_accumulation_steps == 1
+                                        and self._register_optimizer_comm_hook())
+
+    @staticmethod
+    def _init_distributed(local_rank: int, device: Union[None, str, torch.device]) -> Union[None, str, torch.device]:
+        """
+        Initialize the process group for distributed data parallel training (NCCL on GPUs, gloo on CPUs)
+
+        :param local_rank: Rank of the process on the current node
+        :param device: Device given in the configuration, only kept if no GPU is available
+        :return: The device to be used by the current process
+        """
+        if torch.cuda.is_available():
+            device = torch.device(f"cuda:{local_rank}")
+            torch.cuda.set_device(device)
+        if not dist.is_initialized():
+            dist.init_process_group(backend="nccl" if torch.cuda.is_available() else "gloo")
+        return device
+
+    @staticmethod
+    def _supports_bf16(device: Union[None, str, torch.device]) -> bool:
+        if device is None or torch.device(device).type != "cuda":
+            return False
+        # Checked for the device of the solver, which is not necessarily the current one. Emulated bfloat16 on older
+        # GPUs is slower than float32, so only native support counts
+        with torch.cuda.device(torch.device(device)):
+            return torch.cuda.is_bf16_supported(including_emulation=False)
+
+    def _get_network_module(self) -> torch.nn.Module:
+        """ Returns the network without the DistributedDataParallel wrapper """
+        if isinstance(self.network, DistributedDataParallel):
+            return self.network.module
+        return self.network
+
+    def _register_optimizer_comm_hook(self) -> bool:
+        """
+        Run the optimizer step for the parameters of each gradient bucket directly after its all-reduce,
+        overlapping the optimizer with the remaining communication of the backward pass.
+
+        :return: True if the hook was registered, False if the optimizer has no functional counterpart
+                 and must be stepped explicitly
+        """
+        functional_optimizer_class = functional_optim_map.get(type(self.optimizer))
+        if functional_optimizer_class is None:
+            return False
+        accepted_arguments = inspect.signature(functional_optimizer_class.__init__).parameters
+        optimizer_arguments = {key: value for key, value in self.optimizer.param_groups[0].items()
+                               if key != "params" and key in accepted_arguments and value is not None}
+        functional_optimizer = as_functional_optim(type(self.optimizer), **optimizer_arguments)
+        self.network.register_comm_hook(None, _hook_then_optimizer(allreduce_hook,
+                                                                   _OptimizerHookState(functional_optimizer)))
+        return True
+
+    def _compile_output_and_loss(self):
+        """
+        If the model was compiled (disable_pytorch_compile: False), the output transformation and the loss are
+        compiled as well, so that they can be fused into fewer kernels. The model itself is compiled separately,
+        because nesting it in another compiled function fails for some models (e.g. CNN).
+        """
+        if not hasattr(self._get_network_module(), "_orig_mod"):
+            return
+        if self.device is not None and torch.device(self.device).type == "cuda":
+            # No CUDA graphs: their outputs are overwritten by the next replay, but the losses are kept for the epoch
+            self._output_and_loss = torch.compile(self._output_and_loss, fullgraph=False)
+        else:
+            # Same backend as for the model, inductor is not available on all platforms
+            self._output_and_loss = torch.compile(self._output_and_loss, backend="aot_eager")
+
+    @staticmethod
+    def _to_distributed_dataloader(dataloader: DataLoader, shuffle: bool) -> DataLoader:
+        """
+        Rebuild the dataloader, such that every process only sees its own shard of the dataset.
+
+        :param dataloader: Dataloader of the complete dataset
+        :param shuffle: Training dataloaders are shuffled and padded to the same number of samples on every process.
+                        Otherwise, the shards are not padded, so evaluation sees every sample exactly once.
+        :return: The dataloader of the shard of the current process
+        """
+        if shuffle:
+            sampler = DistributedSampler(dataloader.dataset, shuffle=True)
+        else:
+            # DistributedSampler pads the shards with duplicated samples, which would be counted in the metrics
+            sampler = range(dist.get_rank(), len(dataloader.dataset), dist.get_world_size())
+        return DataLoader(
+            dataset=dataloader.dataset, batch_size=dataloader.batch_size, sampler=sampler,
+            drop_last=dataloader.drop_last, collate_fn=dataloader.collate_fn, num_workers=dataloader.num_workers,
+            pin_memory=dataloader.pin_memory
+        )
+
+    def _average_across_processes(self, *iteration_results: List[Dict[str, Any]]) -> List[float]:
+        """
+        Average the losses of the batches of all processes, so that all of them make the same early stopping decision.
 
-    def __del__(self):
-        self._tempdir.cleanup()
+        :param iteration_results: Iteration results of each phase of the epoch (e.g. training and validation).
+                                  Unpadded shards can have a different number of batches in each process.
+        :return: The mean loss of each phase
+        """
+        loss_sums = torch.stack([
+            torch.stack([i["loss"] for i in results]).sum().to(torch.float64) if len(results) > 0
+            else torch.zeros((), dtype=torch.float64, device=self.device) for results in iteration_results
+        ])
+        batch_counts = torch.tensor([len(results) for results in iteration_results], dtype=torch.float64,
+                                    device=loss_sums.device)
+        losses = torch.cat([loss_sums, batch_counts])
+        if self._is_distributed:
+            # Both phases are reduced together, with a single all-reduce per epoch
+            dist.all_reduce(losses, op=dist.ReduceOp.SUM)
+        loss_sums, batch_counts = losses.split(len(iteration_results))
+        return (loss_sums / batch_counts).tolist()
 
     def train(self, training_dataloader: DataLoader, validation_dataloader: DataLoader) -> List[Dict[str, Any]]:
         # Get things ready
         self.network = self.network.train()
         self._min_loss = math.inf
         epoch_iterations = list()
+        self.optimizer.zero_grad(set_to_none=True)
+
+        if self._is_distributed:
+            training_dataloader = self._to_distributed_dataloader(training_dataloader, shuffle=True)
+            validation_dataloader = self._to_distributed_dataloader(validation_dataloader, shuffle=False)
 
         # Make an initial save of the model if trained from scratch
         if self.start_epoch == 0:
             self.save_checkpoint(0)
 
+        # Resolved once, the steps are counted over all epochs instead of being recomputed for every batch
+        training_length = len(training_dataloader)
+        training_step = 0
+        validation_step = 0
+
         for epoch in range(self.start_epoch, self.number_of_epochs):
+            if self._is_distributed:
+                # Different shuffling in every epoch
+                training_dataloader.sampler.set_epoch(epoch)
 
             # Evaluating before testing: This way val_loss > train_loss holds for most epochs
             # If we would train before validating, the validation would benefit from the knowledge gained during
             # training, thus most likely val_loss < train_loss would be true for most epochs (and a bit confusing)
             validation_iterations = list()
             for i, (_, X, y, lengths) in enumerate(validation_dataloader):
+                validation_step += 1
                 iteration_result = self._training_iteration(
-                    X, y, step=len(epoch_iterations) * len(validation_dataloader) + len(validation_iterations) + 1,
-                    context=torch.no_grad, lengths=lengths
+                    X, y, step=validation_step, context=torch.inference_mode, lengths=lengths
                 )
-                validation_iterations.append(iteration_result)
+                # Only the loss is kept, the outputs of a model compiled with CUDA graphs are reused by the next batch
+                validation_iterations.append({"loss": iteration_result["loss"]})
             validation_epoch_metrics = self.metrics_calculator.compute_metrics()
 
             train_iterations = list()
             for i, (_, X, y, lengths) in enumerate(training_dataloader):
+                training_step += 1
+                # The last accumulation group of an epoch can contain fewer batches
+                group_start = i - i % self.gradient_accumulation_steps
+                accumulation_size = min(self.gradient_accumulation_steps, training_length - group_start)
                 iteration_result = self._training_iteration(
-                    X, y, step=len(epoch_iterations) * len(training_dataloader) + len(train_iterations) + 1,
-                    lengths=lengths
+                    X, y, step=training_step, lengths=lengths,
+                    # Update the weights after every gradient_accumulation_steps batches and at the end of the epoch
+                    optimizer_step=(i + 1 - group_start == accumulation_size), accumulation_size=accumulation_size
                 )
-                train_iterations.append(iteration_result)
+                train_iterations.append({"loss": iteration_result["loss"]})
+            self._flush_step_log_buffer()
             train_epoch_metrics = self.metrics_calculator.compute_metrics()
 
+            # Both losses are reduced together, with a single synchronization per epoch
+            train_loss, validation_loss = self._average_across_processes(train_iterations, validation_iterations)
             epoch_metrics = {
-                'training': {**Solver._aggregate_iteration_losses(train_iterations), **train_epoch_metrics},
-                'validation': {**Solver._aggregate_iteration_losses(validation_iterations), **validation_epoch_metrics},
+                'training': {'loss': train_loss, **train_epoch_metrics},
+                'validation': {'loss': validation_loss, **validation_epoch_metrics},
                 'epoch': epoch
             }
 
             epoch_iterations.append(epoch_metrics)
 
             # Logging
-            logger.info(f"Epoch {epoch}")
-            logger.info(f"Training results")
-            for key in epoch_metrics['training']:
-                logger.info(f"\t{key}: {epoch_metrics['training'][key]:.2f}")
-            logger.info(f"Validation results")
-            for key in epoch_metrics['validation']:
-                logger.info(f"\t{key}: {epoch_metrics['validation'][key]:.2f}")
-
-            if self.log_writer:
+            if self._is_main_process:
+                logger.info(f"Epoch {epoch}")
+                logger.info(f"Training results")
+                for key in epoch_metrics['training']:
+                    logger.info(f"\t{key}: {epoch_metrics['training'][key]:.2f}")
+                logger.info(f"Validation results")
+                for key in epoch_metrics['validation']:
+                    logger.info(f"\t{key}: {epoch_metrics['validation'][key]:.2f}")
+
+            if self.log_writer and self._is_main_process:
                 self.log_writer.add_scalars("Epoch/train", epoch_metrics['training'], epoch)
                 self.log_writer.add_scalars("Epoch/validation", epoch_metrics['validation'], epoch)
                 self.log_writer.add_scalars("Epoch/comparison", {
@@ -129,18 +294,39 @@ class Solver(ABC):
         self.network = self.network.eval()
 
         predict_iterations = list()
+        batches = list()
+        predictions = list()
+        logits = list()
+        device_predictions = list()
+        device_logits = list()
+        device_logits_size = 0
         mapped_predictions = dict()
         mapped_probabilities = dict()
 
         for i, (seq_ids, X, y, lengths) in enumerate(dataloader):
             if calculate_test_metrics:  # For test set, y must be valid targets
-                iteration_result = self._training_iteration(
-                    X, y, context=torch.no_grad, lengths=lengths
-                )
+                iteration_result = self._training_iteration(X, y, context=torch.inference_mode, lengths=lengths)
+                predict_iterations.append({"loss": iteration_result["loss"]})
             else:  # For new predictions, y is ignored
                 iteration_result = self._prediction_iteration(x=X, lengths=lengths)
-
-            predict_iterations.append(iteration_result)
+            batches.append((seq_ids, lengths))
+            # Cloned, because the outputs of a model compiled with CUDA graphs are overwritten by the next batch
+            device_predictions.append(iteration_result["prediction"].clone())
+            device_logits.append(iteration_result["logits"].clone())
+            device_logits_size += device_logits[-1].numel()
+
+            # Predictions stay on the device until enough batches are done, then they are transferred at once
+            if device_logits_size >= self._TRANSFER_CHUNK_SIZE:
+                predictions.extend(Solver._tensors_to_cpu(device_predictions))
+                logits.extend(Solver._tensors_to_cpu(device_logits))
+                device_predictions, device_logits, device_logits_size = list(), list(), 0
+        predictions.extend(Solver._tensors_to_cpu(device_predictions))
+        logits.extend(Solver._tensors_to_cpu(device_logits))
+
+        for (seq_ids, lengths), batch_predictions, batch_logits in zip(batches, predictions, logits):
+            iteration_result = self._iteration_result_to_lists(
+                {"prediction": batch_predictions, "logits": batch_logits}, lengths=lengths
+            )
             # Create dict with seq_id: prediction
             for idx, prediction in enumerate(iteration_result["prediction"]):
                 mapped_predictions[seq_ids[idx]] = prediction
@@ -178,7 +364,7 @@ class Solver(ABC):
             self.network = self.network.eval()
             self._enable_dropout(self.network)
             dropout_iteration_result = self._prediction_iteration(x=X, lengths=lengths)
-            dropout_iterations.append(dropout_iteration_result)
+            dropout_iterations.append(self._iteration_result_to_lists(dropout_iteration_result, lengths=lengths))
 
         return dropout_iterations
 
@@ -260,12 +446,14 @@ class Solver(ABC):
         if checkpoint_path:
             checkpoint_file = checkpoint_path
             self.checkpoint_type = checkpoint_path.suffix
-        elif self.log_dir:
-            checkpoint_file = Path(self.log_dir) / self.checkpoint_name
         else:
-            checkpoint_file = Path(self._tempdir.name) / self.checkpoint_name
+            checkpoint_file = self._checkpoint_path
 
-        if checkpoint_file.suffix == '.safetensors':
+        if checkpoint_file is None:
+            if self._best_state is None:
+                raise Exception("Cannot load checkpoint because no checkpoint has been saved yet!")
+            state = self._best_state
+        elif checkpoint_file.suffix == '.safetensors':
             # Load safetensors checkpoint
             state_dict = load_file(str(checkpoint_file))
             state = {
@@ -276,10 +464,10 @@ class Solver(ABC):
             # Load PyTorch checkpoint
             if not allow_torch_pt_loading:
                 raise Exception("Cannot load pt checkpoint because torch_pt_loading is not allowed!")
-            state = torch.load(str(checkpoint_file), map_location=torch.device(self.device))
+            state = torch.load(str(checkpoint_file), map_location=torch.device("cpu"))
 
         try:
-            self.network.load_state_dict(state['state_dict'])
+            self._get_network_module().load_state_dict(self._state_dict_to_device(state['state_dict']))
             if resume_training:
                 self.start_epoch = state['epoch'] + 1
                 if self.start_epoch == self.number_of_epochs:
@@ -292,6 +480,18 @@ class Solver(ABC):
         except RuntimeError as e:
             raise Exception(f"Defined model architecture does not seem to match pretrained model!") from e
 
+    def _state_dict_to_device(self, state_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Checkpoint files are always loaded on the CPU first. For CUDA devices, the tensors are pinned and copied
+        asynchronously, which is considerably faster than loading them directly onto the device.
+        Checkpoints kept in memory are already on the device.
+        """
+        if self.device is None or torch.device(self.device).type != "cuda":
+            return state_dict
+        return {key: value.pin_memory().to(self.device, non_blocking=True)
+                if isinstance(value, torch.Tensor) and value.device.type == "cpu"
+                else value for key, value in state_dict.items()}
+
     def get_best_epoch(self) -> int:
         if self.start_epoch > 0:
             return self._best_epoch - self.start_epoch
@@ -299,10 +499,19 @@ class Solver(ABC):
             return self._best_epoch
 
     def save_checkpoint(self, epoch: int):
+        if self._checkpoint_path is None:
+            # Only needed to restore the best epoch after training, so the weights are copied instead of written
+            self._best_state = {
+                'epoch': epoch,
+                'state_dict': {key: value.detach().clone()
+                               for key, value in self._get_network_module().state_dict().items()}
+            }
+            return
+
         # Prepare the state dictionary
         state = {
             'epoch': torch.tensor(epoch),
-            **self.network.state_dict(),
+            **self._get_network_module().state_dict(),
         }
 
         # Flatten optimizer state
@@ -318,28 +527,34 @@ class Solver(ABC):
         # Ensure all tensors are contiguous
         state = {k: v.contiguous() if isinstance(v, torch.Tensor) else v for k, v in state.items()}
 
-        if self.log_dir:
-            save_path = Path(self.log_dir) / self.checkpoint_name
-        else:
-            save_path = Path(self._tempdir.name) / self.checkpoint_name
+        save_path = self._checkpoint_path
 
-        save_file(state, str(save_path))
+        # The log directory is shared by all processes, only the main process writes the checkpoint
+        if self._is_main_process:
+            save_file(state, str(save_path))
+        if self._is_distributed:
+            dist.barrier()
         # Log checkpoint path on start of training
-        if epoch == 0:
+        if epoch == 0 and self._is_main_process:
             logger.info(f"Checkpoint(s) will be stored at {save_path}")
 
     def save_as_onnx(self, embedding_dimension: int, output_dir: Optional[str] = None) -> str:
         output_dir = output_dir if output_dir is not None else self.log_dir
 
-        dummy_input = self.protocol.get_dummy_input(embedding_dimension).to(self.device)
+        # Batch size > 1, because the exporter specializes dimensions of size 1 to static dimensions
+        dummy_input = self.protocol.get_dummy_input(embedding_dimension, batch_size=2).to(self.device)
 
         # Use eval mode during export to avoid batch size problems
-        self.network.eval()
+        network = self._get_network_module().eval()
+        # The exporter traces the original module, a compiled wrapper would be traced through dynamo a second time
+        network = getattr(network, "_orig_mod", network)
 
         # Export
         onnx_file_name = f"{output_dir}/{self.checkpoint_name.split('.')[0]}.onnx"
 
-        self._onnx_export_strategy(network=self.network, dummy_input=dummy_input, onnx_file_name=onnx_file_name)
+        self._onnx_export_strategy(network=network, dummy_input=dummy_input, onnx_file_name=onnx_file_name)
+        # Validate once after export, so that loading the model for inference does not need to do it
+        onnx.checker.check_model(onnx_file_name)
 
         return onnx_file_name
 
@@ -364,11 +579,10 @@ class Solver(ABC):
                 },
             )
         else:
-            export_options = torch.onnx.ExportOptions(dynamic_shapes=True,
-                                                  diagnostic_options=torch.onnx.DiagnosticOptions(
-                                                      verbosity_level=logging.ERROR))
-            onnx_program = torch.onnx.dynamo_export(network, dummy_input,
-                                                export_options=export_options)
+            # All dimensions but the embedding dimension (batch size and sequence length) are exported as symbolic
+            dynamic_shapes = ({dimension: torch.export.Dim.AUTO for dimension in range(dummy_input.dim() - 1)},)
+            onnx_program = torch.onnx.export(network, (dummy_input,), dynamo=True, dynamic_shapes=dynamic_shapes,
+                                             input_names=['input'], output_names=['output'], verbose=False)
             onnx_program.save(onnx_file_name)
 
     def _early_stop(self, current_loss: float, epoch: int) -> bool:
@@ -389,8 +603,43 @@ class Solver(ABC):
 
     @staticmethod
     def _aggregate_iteration_losses(iteration_results) -> Dict[str, Any]:
-        mean_loss = sum([i["loss"] for i in iteration_results]) / len(iteration_results)
-        return {"loss": mean_loss}
+        return {"loss": Solver._mean_loss(iteration_results).item()}
+
+    @staticmethod
+    def _mean_loss(iteration_results) -> torch.Tensor:
+        # Losses are kept as tensors on the device, so they are averaged without synchronization
+        return torch.stack([i["loss"] for i in iteration_results]).mean()
+
+    @staticmethod
+    def _tensors_to_cpu(tensors: Sequence[torch.Tensor]) -> List[torch.Tensor]:
+        """
+        Move tensors of (possibly) different shapes to the cpu with a single transfer.
+
+        :param tensors: Tensors of the same dtype on the same device
+        :return: The tensors on the cpu
+        """
+        if len(tensors) == 0 or tensors[0].device.type == "cpu":
+            return list(tensors)
+        flat_tensors = torch.cat([tensor.flatten() for tensor in tensors]).cpu()
+        return [flat_tensor.view(tensor.shape) for flat_tensor, tensor
+                in zip(flat_tensors.split([tensor.numel() for tensor in tensors]), tensors)]
+
+    def _iteration_result_to_lists(self, iteration_result: Dict[str, Any],
+                                   lengths: Optional[torch.LongTensor] = None) -> Dict[str, Any]:
+        """
+        Convert predictions and logits of an iteration to lists of predictions and probabilities.
+        This is only done for inference, during training they stay on the device.
+
+        :param iteration_result: Result dict of a training or prediction iteration
+        :param lengths: Lengths of the sequences in the batch
+        :return: The iteration result with predictions and probabilities as lists
+        """
+        result_dict = {key: value for key, value in iteration_result.items() if key != 'logits'}
+        # Transform logits to probabilities if necessary
+        probabilities = self._logits_to_probabilities(iteration_result['logits'])
+        return {**result_dict,
+                'prediction': iteration_result['prediction'].tolist(),
+                'probabilities': probabilities.tolist()}
 
     def _transform_network_output(self, network_output: torch.Tensor) -> torch.Tensor:
         """
@@ -424,7 +673,7 @@ class Solver(ABC):
 
     def _training_iteration(
             self, x: torch.Tensor, y: torch.Tensor, step=1, context: Optional[Callable] = None,
-            lengths: Optional[torch.LongTensor] = None
+            lengths: Optional[torch.LongTensor] = None, optimizer_step: bool = True, accumulation_size: int = 1
     ) -> Dict[str, Union[float, list, Dict[str, Union[float, int]]]]:
         do_loss_propagation = False
 
@@ -432,53 +681,76 @@ class Solver(ABC):
             context = _nullcontext
             do_loss_propagation = True
 
-        # Move everything on device
-        x = x.to(self.device)
-        y = y.to(self.device)
+        # Move everything on device, asynchronous if the dataloader provides pinned memory
+        x = x.to(self.device, non_blocking=True)
+        y = y.to(self.device, non_blocking=True)
 
         with context():
-            if do_loss_propagation:
-                self.optimizer.zero_grad()
-
-            logits = self.network(x)
-
-            # Apply logit transformations before computing loss
-            logits = self._transform_network_output(logits)
-            loss = self.loss_function(logits, y)
-
-            # Transform logits to probabilities if necessary
-            probabilities = self._logits_to_probabilities(logits)
-            # Discretize predictions if necessary
-            prediction = self._probabilities_to_predictions(probabilities)
-            metrics = self.metrics_calculator.compute_metrics(predicted=prediction, labels=y)
+            # Mixed precision is only used for training, evaluation and test metrics are computed in full precision
+            with torch.autocast(device_type=x.device.type, dtype=torch.bfloat16,
+                                enabled=self.use_mixed_precision and do_loss_propagation):
+                # Evaluation bypasses DistributedDataParallel, the processes can have different numbers of batches
+                network = self.network if do_loss_propagation else self._get_network_module()
+                logits, loss = self._output_and_loss(network(x), y)
+            # Predictions and metrics are calculated in full precision
+            logits = logits.float()
+
+            # Discretize predictions if necessary. Softmax is monotonic, so no probabilities are needed for that,
+            # they are only calculated for inference results. Detached, so the metric states do not keep the graph
+            prediction = self._probabilities_to_predictions(logits.detach())
+            if do_loss_propagation and self.log_writer and self._is_main_process:
+                # Computes the step metrics as 0-d tensors (also accumulating them for the epoch).
+                # Writing them requires a synchronization, so they are buffered until the epoch ends
+                self._step_log_buffer.append(
+                    (step, self.metrics_calculator.compute_metric_tensors(predicted=prediction, labels=y))
+                )
+            else:
+                # Only accumulate on the device, the metrics are computed once per epoch
+                self.metrics_calculator.update(predicted=prediction, labels=y)
 
             if do_loss_propagation:
-                # Do a forward pass & update weights
-                self.optimizer.zero_grad()  # clear gradients for next train
-                loss.backward()  # backpropagation, compute gradients
-                self.optimizer.step()  # apply gradients
-
-                if self.log_writer:
-                    self.log_writer.add_scalars("Step/train", metrics, step)
+                # Gradients of accumulated batches are not synchronized between processes before the optimizer step
+                sync_context = self.network.no_sync if self._is_distributed and not optimizer_step else _nullcontext
+                with sync_context():
+                    # Scale the loss, so that the accumulated gradients are the mean over the accumulated batches
+                    (loss / accumulation_size).backward()  # backpropagation, compute gradients
+                if optimizer_step:
+                    if not self._optimizer_in_comm_hook:
+                        self.optimizer.step()  # apply gradients
+                    self.optimizer.zero_grad(set_to_none=True)  # clear gradients for next train
 
             return {
-                'loss': loss.item(),
-                'prediction': prediction.tolist(),
-                'probabilities': probabilities
+                'loss': loss.detach(),
+                'prediction': prediction.detach(),
+                'logits': logits.detach()
             }
 
+    def _flush_step_log_buffer(self):
+        """ Log the metrics of the buffered training steps, they are copied to the cpu at once """
+        if len(self._step_log_buffer) == 0:
+            return
+        step_values = torch.stack([torch.stack([value.float() for value in step_metrics.values()])
+                                   for _, step_metrics in self._step_log_buffer]).tolist()
+        for (step, step_metrics), values in zip(self._step_log_buffer, step_values):
+            self.log_writer.add_scalars("Step/train", dict(zip(step_metrics.keys(), values)), step)
+        self._step_log_buffer.clear()
+
+    def _output_and_loss(self, logits: torch.Tensor, y: torch.Tensor) -> (torch.Tensor, torch.Tensor):
+        # Apply logit transformations before computing loss
+        logits = self._transform_network_output(logits)
+        loss = self.loss_function(logits, y)
+        return logits, loss
+
     def _prediction_iteration(self, x: torch.Tensor, lengths: Optional[torch.LongTensor] = None) -> \
-            Dict[str, Union[List, torch.Tensor]]:
+            Dict[str, torch.Tensor]:
 
-        with torch.no_grad():
-            # Move everything on device
-            x = x.to(self.device)
-            logits = self.network(x)
+        with torch.inference_mode():
+            # Move everything on device, asynchronous if the dataloader provides pinned memory
+            x = x.to(self.device, non_blocking=True)
+            # Inference does not need DistributedDataParallel, it can also run in a single process after training
+            logits = self._get_network_module()(x)
             # Apply transformations
             logits = self._transform_network_output(logits)
-            # Transform logits to probabilities if necessary
-            probabilities = self._logits_to_probabilities(logits)
             # Discretize predictions if necessary
-            prediction = self._probabilities_to_predictions(probabilities)
-            return {"prediction": prediction.tolist(),
-                    "probabilities": probabilities.tolist()}
+            prediction = self._probabilities_to_predictions(logits)
+            return {"prediction": prediction, "logits": logits}
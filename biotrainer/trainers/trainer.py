@@ -1,7 +1,9 @@
+import os
 import time
 import torch
 import random
 import datetime
+import torch.distributed as dist
 
 from pathlib import Path
 from torch.utils.data import DataLoader
@@ -127,6 +129,14 @@ class Trainer:
         end_time_total = time.perf_counter()
         self._output_vars["elapsed_time_total"] = end_time_total - start_time_total
 
+        # Training is done, the evaluation and the exports of the best model only run in the main process.
+        # Destroying the process group also keeps the metrics from waiting for the other processes to synchronize.
+        if dist.is_initialized():
+            is_main_process = dist.get_rank() == 0
+            dist.destroy_process_group()
+            if not is_main_process:
+                return self._output_vars
+
         self._log_average_result_of_splits(split_results)
         best_split = self._get_best_model_of_splits(split_results)
 
@@ -248,9 +258,11 @@ class Trainer:
 
     def _create_dataloader(self, dataset, hyper_params: Dict) -> torch.utils.data.dataloader.DataLoader:
         # Create dataloader from dataset
+        # Pinned batches allow the solver to copy them to the GPU without blocking
         return DataLoader(
             dataset=dataset, batch_size=hyper_params["batch_size"], shuffle=hyper_params["shuffle"], drop_last=False,
-            collate_fn=get_collate_function(self._protocol)
+            collate_fn=get_collate_function(self._protocol),
+            pin_memory=self._device is not None and torch.device(self._device).type == "cuda"
         )
 
     def _create_writer(self, hyper_params: Dict) -> torch.utils.tensorboard.writer.SummaryWriter:
@@ -274,8 +286,13 @@ class Trainer:
     def _create_solver(self, split_name, model, loss_function, optimizer, writer, hyper_params: Dict) -> Solver:
         return get_solver(protocol=self._protocol, name=split_name, network=model, optimizer=optimizer,
                           loss_function=loss_function, device=self._device, number_of_epochs=hyper_params["num_epochs"],
-                          patience=hyper_params["patience"], epsilon=hyper_params["epsilon"], log_writer=writer,
-                          log_dir=hyper_params["log_dir"], num_classes=self._output_vars['n_classes'])
+                          patience=hyper_params["patience"], epsilon=hyper_params["epsilon"],
+                          gradient_accumulation_steps=hyper_params["gradient_accumulation_steps"],
+                          use_mixed_precision=hyper_params["use_mixed_precision"],
+                          use_optimizer_in_comm_hook=hyper_params["use_optimizer_in_comm_hook"], log_writer=writer,
+                          log_dir=hyper_params["log_dir"], num_classes=self._output_vars['n_classes'],
+                          # Set by torchrun for distributed data parallel training
+                          local_rank=int(os.environ["LOCAL_RANK"]) if "LOCAL_RANK" in os.environ else None)
 
     def _run_cross_validation(self, splits: List[Split]) -> List[SplitResult]:
         split_results = list()
@@ -403,8 +420,11 @@ class Trainer:
     def _create_model_loss_optimizer(self, class_weights: Optional[torch.Tensor] = None,
                                      **kwargs) -> (torch.nn.Module, torch.nn.Module, torch.nn.Module):
         # Initialize model
+        # On GPUs, the compiled model replays the kernels of a batch shape from a CUDA graph
+        compile_mode = "reduce-overhead" if self._device is not None and torch.device(self._device).type == "cuda" \
+            else None
         model = get_model(n_classes=self._output_vars["n_classes"], n_features=self._output_vars["n_features"],
-                          **kwargs)
+                          compile_mode=compile_mode, **kwargs)
 
         # Initialize loss function
         loss_function = get_loss(weight=class_weights, **kwargs)
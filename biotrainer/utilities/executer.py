@@ -124,11 +124,12 @@ def parse_config_file_and_execute_run(config: Union[str, Path, Dict[str, Any]])
                       )
     output_result = trainer.training_and_evaluation_routine()
 
-    # Save output_variables in out.yml
-    _write_output_file(
-        str(Path(output_result['output_dir']) / "out.yml"),
-        output_result
-    )
+    # Save output_variables in out.yml, only once for distributed training (RANK is set by torchrun)
+    if int(os.environ.get("RANK", 0)) == 0:
+        _write_output_file(
+            str(Path(output_result['output_dir']) / "out.yml"),
+            output_result
+        )
 
     _clear_logging()
 
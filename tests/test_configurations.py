@@ -164,7 +164,7 @@ class ConfigurationVerificationTests(unittest.TestCase):
             configurator.get_verified_config()
 
     def test_wrong_model(self):
-        config_dict = configurations["minimal"]
+        config_dict = deepcopy(configurations["minimal"])
         config_dict["model_choice"] = "RNN123"
         configurator = Configurator.from_config_dict(config_dict)
 
@@ -180,7 +180,7 @@ class ConfigurationVerificationTests(unittest.TestCase):
             configurator.get_verified_config()
 
     def test_non_existing_embedder(self):
-        config_dict = configurations["minimal"]
+        config_dict = deepcopy(configurations["minimal"])
         config_dict["embedder_name"] = "two_hot_encodings"
         configurator = Configurator.from_config_dict(config_dict)
 
@@ -494,3 +494,46 @@ class ConfigurationVerificationTests(unittest.TestCase):
 
             with self.assertRaises(ConfigurationException) as context:
                 configurator.get_verified_config()
+
+    def test_gradient_accumulation_steps(self):
+        config_dict = deepcopy(configurations["minimal"])
+        # Positive integers are valid
+        valid_values = [1, 4, 32]
+        for valid_value in valid_values:
+            config_dict["gradient_accumulation_steps"] = valid_value
+
+            configurator = Configurator.from_config_dict(config_dict)
+            self.assertTrue(
+                configurator.get_verified_config(),
+                f"Valid gradient_accumulation_steps: {valid_value} failed"
+            )
+
+        # Other values are not valid
+        invalid_values = [0, -1, 2.5, "2"]
+        for invalid_value in invalid_values:
+            config_dict["gradient_accumulation_steps"] = invalid_value
+            configurator = Configurator.from_config_dict(config_dict)
+
+            with self.assertRaises(ConfigurationException) as context:
+                configurator.get_verified_config()
+
+    def test_training_boolean_options(self):
+        for option in ["use_gradient_checkpointing", "use_mixed_precision"]:
+            config_dict = deepcopy(configurations["minimal"])
+            for valid_value in [True, False]:
+                config_dict[option] = valid_value
+
+                configurator = Configurator.from_config_dict(config_dict)
+                self.assertTrue(
+                    configurator.get_verified_config(),
+                    f"Valid {option}: {valid_value} failed"
+                )
+
+            # Other values are not valid
+            invalid_values = ["True", "yes", 1, 0.5]
+            for invalid_value in invalid_values:
+                config_dict[option] = invalid_value
+                configurator = Configurator.from_config_dict(config_dict)
+
+                with self.assertRaises(ConfigurationException) as context:
+                    configurator.get_verified_config()
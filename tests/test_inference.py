@@ -1,9 +1,12 @@
 import tempfile
 import unittest
+import threading
+import onnxruntime
 import numpy as np
 import torch._dynamo
 
 from sys import platform
+from unittest import mock
 from typing import Dict, Union, List
 
 from biotrainer.inference import Inferencer
@@ -72,6 +75,14 @@ class InferencerTests(unittest.TestCase):
                                                             length_to_pad=max_seq_length, device="cpu") == target,
                             "Padding changed a non-list value!")
 
+    def test_class_str2int_conversion(self):
+        for target in self._test_targets_r2c:
+            converted = self.inferencer_r2c._convert_class_str2int(target)
+            self.assertTrue(list(converted) == [self.inferencer_r2c.class_str2int[t] for t in target],
+                            "Per-residue class conversion does not match the class mapping!")
+        with self.assertRaises(KeyError):
+            self.inferencer_r2c._convert_class_str2int("CDX")
+
     def test_from_embeddings(self):
         r2c_dict = self.inferencer_r2c.from_embeddings(self.per_residue_embeddings)
         rs2c_dict = self.inferencer_rs2c.from_embeddings(self.per_residue_embeddings)
@@ -291,6 +302,53 @@ class InferencerTests(unittest.TestCase):
                     print(prediction_errors)
                 self.assertTrue(len(prediction_errors) == 0)
 
+    def test_onnx_dynamic_batch_size(self):
+        if "win" in platform.lower():
+            return  # Disable this test on Windows for now, because of ONNX stability issues
+
+        # Sequences of equal length, so that the per-residue embeddings are predicted in one batch, too
+        embedder = OneHotEncodingEmbedder()
+        per_residue_embeddings = {f"Seq{idx}": embedding for idx, embedding in
+                                  enumerate(embedder.embed_many(["SEQVENCE", "SEQWENCE", "PRTEINSS"]))}
+        per_sequence_embeddings = {seq_id: embedder.reduce_per_protein(embedding) for seq_id, embedding in
+                                   per_residue_embeddings.items()}
+
+        for inferencer in self.inferencer_list:
+            with tempfile.TemporaryDirectory() as tmp_dir_name:
+                model_path = inferencer.convert_to_onnx(tmp_dir_name)[0]
+
+                # The batch dimension of the exported model must be symbolic, not fixed to the dummy input
+                batch_dimension = onnxruntime.InferenceSession(model_path).get_inputs()[0].shape[0]
+                self.assertIsInstance(batch_dimension, str,
+                                      f"Batch dimension of {inferencer.protocol} ONNX model is static!")
+
+                embeddings = per_sequence_embeddings \
+                    if inferencer.protocol in Protocol.using_per_sequence_embeddings() else per_residue_embeddings
+                onnx_result_dict = Inferencer.from_onnx_with_embeddings(model_path=model_path,
+                                                                        embeddings=embeddings,
+                                                                        protocol=inferencer.protocol)
+                inferencer_result_dict = inferencer.from_embeddings(embeddings=embeddings,
+                                                                    include_probabilities=True)
+
+                prediction_errors = self._compare_predictions(preds=onnx_result_dict,
+                                                              other_preds=inferencer_result_dict[
+                                                                  "mapped_probabilities"])
+                if len(prediction_errors) > 0:
+                    print(prediction_errors)
+                self.assertTrue(len(prediction_errors) == 0)
+
+                # Embeddings of different lengths are predicted in different batches, the order must be kept
+                other_embeddings = self.per_sequence_embeddings \
+                    if inferencer.protocol in Protocol.using_per_sequence_embeddings() else self.per_residue_embeddings
+                mixed_embeddings = [embedding for embedding_pair in zip(other_embeddings.values(), embeddings.values())
+                                    for embedding in embedding_pair]
+                mixed_result_dict = Inferencer.from_onnx_with_embeddings(model_path=model_path,
+                                                                         embeddings=mixed_embeddings,
+                                                                         protocol=inferencer.protocol)
+                self.assertEqual(list(mixed_result_dict.keys()), [str(idx) for idx in range(len(mixed_embeddings))])
+                self.assertTrue(np.allclose(np.array(list(mixed_result_dict.values())[1::2]),
+                                            np.array(list(onnx_result_dict.values())), atol=1e-6))
+
     def test_single_vs_batch_prediction(self):
         for inferencer in self.inferencer_list:
             embeddings = self.per_sequence_embeddings \
@@ -309,3 +367,17 @@ class InferencerTests(unittest.TestCase):
             if len(prediction_errors) > 0:
                 print(prediction_errors)
             self.assertTrue(len(prediction_errors) == 0)
+
+    def test_compiled_warm_up_in_calling_thread(self):
+        # CUDA graphs recorded during the warm-up can only be replayed in the thread that recorded them
+        warm_up_threads = []
+        warm_up_compiled_network = Inferencer._warm_up_compiled_network
+
+        def _record_warm_up_thread(inferencer, solver, batch_size):
+            warm_up_threads.append(threading.current_thread())
+            return warm_up_compiled_network(inferencer, solver, batch_size)
+
+        with mock.patch.object(Inferencer, "_warm_up_compiled_network", _record_warm_up_thread):
+            # Compiled model
+            Inferencer.create_from_out_file("test_input_files/test_models/rs2c/out.yml")
+        self.assertEqual(warm_up_threads, [threading.current_thread()])
@@ -0,0 +1,28 @@
+import torch
+import unittest
+
+from biotrainer.models import get_model
+from biotrainer.protocols import Protocol
+
+
+class ModelTests(unittest.TestCase):
+
+    def _gradients(self, model: torch.nn.Module, x: torch.Tensor):
+        model.zero_grad(set_to_none=True)
+        # Same dropout masks in both runs, checkpointing restores the random state for the recomputation
+        torch.manual_seed(0)
+        model(x).sum().backward()
+        return {name: parameter.grad.clone() for name, parameter in model.named_parameters()}
+
+    def test_gradient_checkpointing_matches_forward(self):
+        x = torch.randn(16, 20, 24)
+        for model_choice in ["FNN", "DeeperFNN"]:
+            model = get_model(protocol=Protocol.residue_to_class, model_choice=model_choice, n_classes=3,
+                              n_features=24, use_gradient_checkpointing=True).train()
+            checkpointed_gradients = self._gradients(model, x)
+            model.use_gradient_checkpointing = False
+            gradients = self._gradients(model, x)
+
+            for name, gradient in gradients.items():
+                self.assertTrue(torch.allclose(checkpointed_gradients[name], gradient, atol=1e-6),
+                                f"Gradient checkpointing changes the gradients of {name} for {model_choice}!")
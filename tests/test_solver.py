@@ -0,0 +1,171 @@
+import torch
+import tempfile
+import unittest
+
+from copy import deepcopy
+from unittest import mock
+from typing import Optional
+from torch.utils.data import DataLoader, Dataset
+
+from biotrainer.losses import get_loss
+from biotrainer.models import get_model
+from biotrainer.protocols import Protocol
+from biotrainer.solvers import get_solver, Solver
+from biotrainer.utilities import DatasetSample, seed_all
+from biotrainer.datasets import get_dataset, get_collate_function
+
+
+class SolverTests(unittest.TestCase):
+    _protocol = Protocol.sequence_to_value
+    _n_features = 8
+    _n_samples = 20
+
+    def setUp(self) -> None:
+        seed_all(42)
+        self.dataset = self._create_dataset(torch.Generator().manual_seed(0))
+        # Unrelated to the training samples, so that the model overfits after a few epochs
+        self.validation_dataset = self._create_dataset(torch.Generator().manual_seed(1))
+        # All solvers of a test start with the same weights
+        self.initial_state_dict = get_model(protocol=self._protocol, model_choice="FNN", n_classes=1,
+                                            n_features=self._n_features, dropout_rate=0.0).state_dict()
+
+    def _create_dataset(self, generator: torch.Generator) -> Dataset:
+        samples = [DatasetSample(f"Seq{idx}", torch.randn(self._n_features, generator=generator),
+                                 torch.randn(1, generator=generator)[0]) for idx in range(self._n_samples)]
+        return get_dataset(self._protocol, samples)
+
+    def _create_dataloader(self, batch_size: int, dataset: Optional[Dataset] = None) -> DataLoader:
+        return DataLoader(dataset if dataset is not None else self.dataset, batch_size=batch_size, shuffle=False,
+                          collate_fn=get_collate_function(self._protocol))
+
+    def _create_solver(self, device: str = "cpu", compile_mode: Optional[str] = None, patience: int = 10,
+                       log_dir: Optional[str] = None, **kwargs) -> Solver:
+        model = get_model(protocol=self._protocol, model_choice="FNN", n_classes=1, n_features=self._n_features,
+                          dropout_rate=0.0, disable_pytorch_compile=compile_mode is None, compile_mode=compile_mode)
+        getattr(model, "_orig_mod", model).load_state_dict(self.initial_state_dict)
+        return get_solver(protocol=self._protocol, name="test", network=model,
+                          optimizer=torch.optim.SGD(model.parameters(), lr=0.1),
+                          loss_function=get_loss(protocol=self._protocol, loss_choice="mean_squared_error",
+                                                 device=device),
+                          device=device, patience=patience, epsilon=0.001, log_dir=log_dir, num_classes=1, **kwargs)
+
+    def test_gradient_accumulation_matches_larger_batch(self):
+        # 20 samples: Batches of 12 and 8 samples, or two accumulation groups of 3 and (the last one) 2 batches
+        large_batch_solver = self._create_solver(number_of_epochs=1)
+        large_batch_solver.train(self._create_dataloader(batch_size=12), self._create_dataloader(batch_size=12))
+        accumulation_solver = self._create_solver(number_of_epochs=1, gradient_accumulation_steps=3)
+        accumulation_solver.train(self._create_dataloader(batch_size=4), self._create_dataloader(batch_size=4))
+
+        large_batch_state_dict = large_batch_solver.network.state_dict()
+        for key, value in accumulation_solver.network.state_dict().items():
+            self.assertTrue(torch.allclose(value, large_batch_state_dict[key], atol=1e-6),
+                            f"Accumulated gradients do not match the larger batch for {key}!")
+
+    def test_early_stopping_restores_best_epoch_without_log_dir(self):
+        best_state_dicts = []
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            # The checkpoint of the best epoch is kept in memory without a log directory, otherwise written to a file
+            for log_dir in [None, tmp_dir_name]:
+                solver = self._create_solver(number_of_epochs=20, patience=2, log_dir=log_dir)
+                epoch_iterations = solver.train(self._create_dataloader(batch_size=4),
+                                                self._create_dataloader(batch_size=4,
+                                                                        dataset=self.validation_dataset))
+                self.assertLess(len(epoch_iterations), 20, "Early stopping was not triggered!")
+                last_state_dict = deepcopy(solver.network.state_dict())
+
+                solver.load_checkpoint(resume_training=False)
+                self.assertGreater(solver.start_epoch, 0, "The best epoch should not be the untrained model!")
+                self.assertLess(solver.start_epoch, epoch_iterations[-1]["epoch"])
+                best_state_dicts.append(solver.network.state_dict())
+                self.assertFalse(all(torch.equal(value, best_state_dicts[-1][key])
+                                     for key, value in last_state_dict.items()),
+                                 "The weights of the best epoch were not restored!")
+
+        for key, value in best_state_dicts[0].items():
+            self.assertTrue(torch.equal(value, best_state_dicts[1][key]),
+                            f"Checkpoint in memory and checkpoint file differ for {key}!")
+
+    def test_step_metrics_are_logged_per_batch(self):
+        class _LogWriter:
+            def __init__(self):
+                self.scalars = []
+
+            def add_scalars(self, tag, values, step):
+                self.scalars.append((tag, values, step))
+
+        log_writer = _LogWriter()
+        solver = self._create_solver(number_of_epochs=2, log_writer=log_writer)
+        epoch_iterations = solver.train(self._create_dataloader(batch_size=4), self._create_dataloader(batch_size=4))
+
+        step_scalars = [(values, step) for tag, values, step in log_writer.scalars if tag == "Step/train"]
+        # 5 batches per epoch
+        self.assertEqual([step for _, step in step_scalars], list(range(1, 11)))
+        for values, _ in step_scalars:
+            self.assertEqual(set(values.keys()), set(epoch_iterations[0]["training"].keys()) - {"loss"})
+            self.assertTrue(all(isinstance(value, float) for value in values.values()))
+        self.assertEqual(len(solver._step_log_buffer), 0)
+
+    @unittest.skipUnless(torch.cuda.is_available(), "CUDA graphs are only used on GPUs")
+    def test_compiled_training_on_gpu(self):
+        epoch_results = []
+        inference_results = []
+        for compile_mode in [None, "reduce-overhead"]:
+            solver = self._create_solver(device="cuda", compile_mode=compile_mode,
+                                         number_of_epochs=3, use_mixed_precision=False)
+            epoch_results.append(solver.train(self._create_dataloader(batch_size=4),
+                                              self._create_dataloader(batch_size=4)))
+            inference_results.append(solver.inference(self._create_dataloader(batch_size=4)))
+
+        # Losses of all batches, not only the ones of the last batch (whose CUDA graph outputs were reused)
+        for eager_epoch, compiled_epoch in zip(*epoch_results):
+            for phase in ["training", "validation"]:
+                self.assertAlmostEqual(eager_epoch[phase]["loss"], compiled_epoch[phase]["loss"], places=3,
+                                       msg=f"Compiled {phase} loss differs in epoch {eager_epoch['epoch']}!")
+
+        # Predictions of all batches, not only the ones of the last batch
+        eager_predictions, compiled_predictions = [result["mapped_predictions"] for result in inference_results]
+        for seq_id, prediction in eager_predictions.items():
+            self.assertAlmostEqual(prediction, compiled_predictions[seq_id], places=3,
+                                   msg=f"Compiled prediction differs for {seq_id}!")
+
+    @unittest.skipUnless(torch.cuda.is_available(), "CUDA graphs are only used on GPUs")
+    def test_cuda_graphs_are_replayed_after_first_epoch(self):
+        from torch._dynamo.utils import counters
+        from torch._inductor.cudagraph_trees import CUDAGraphNode
+
+        replays = []
+        run_graph = CUDAGraphNode.run_graph
+
+        def _count_replay(node):
+            replays.append(node)
+            return run_graph(node)
+
+        solver = self._create_solver(device="cuda", compile_mode="reduce-overhead",
+                                     number_of_epochs=4, use_mixed_precision=False)
+        # The step log buffer is flushed once per epoch, after the training batches
+        replays_at_epoch_end = []
+        flush_step_log_buffer = solver._flush_step_log_buffer
+
+        def _end_epoch():
+            replays_at_epoch_end.append(len(replays))
+            flush_step_log_buffer()
+
+        counters.clear()
+        with mock.patch.object(CUDAGraphNode, "run_graph", _count_replay), \
+                mock.patch.object(solver, "_flush_step_log_buffer", side_effect=_end_epoch):
+            # 20 samples: Batches of 6, 6, 6 and 2 samples, the last batch of every epoch has another shape
+            solver.train(self._create_dataloader(batch_size=6), self._create_dataloader(batch_size=6))
+
+        self.assertEqual(counters["inductor"]["cudagraph_skips"], 0, "CUDA graphs were skipped!")
+        last_epoch_replays = replays_at_epoch_end[-1] - replays_at_epoch_end[-2]
+        # At least one replay per training batch, the batches of the last epoch must not run without CUDA graphs
+        self.assertGreaterEqual(last_epoch_replays, 4, "CUDA graphs are not replayed after the first epoch!")
+
+    def test_inference_transfer_in_chunks(self):
+        solver = self._create_solver()
+        inference_result = solver.inference(self._create_dataloader(batch_size=3))
+        # Transfer after every second batch, the last chunk only contains a single batch
+        solver._TRANSFER_CHUNK_SIZE = 6
+        chunked_inference_result = solver.inference(self._create_dataloader(batch_size=3))
+        self.assertEqual(inference_result["mapped_predictions"], chunked_inference_result["mapped_predictions"])
+        self.assertEqual(len(inference_result["mapped_predictions"]), self._n_samples)